@@ -1,30 +1,39 @@
+import asyncio
 from typing import List, Dict, Optional
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 import pandas as pd
 
-from app.database import get_dataframe
-from app.functions import search_dataframe
+from app.database import get_dataframe, filter_by_producer_ids
+from app.functions import search_dataframe, search_ids, search_many
 
 
 
-router = APIRouter()
+# orjson сериализует ответы в разы быстрее stdlib json
+router = APIRouter(default_response_class=ORJSONResponse)
 templates = Jinja2Templates(directory="app/templates")
 
+# главная страница без результатов статична — рендерим её один раз при старте
+_INDEX_HTML = templates.get_template("index.html").render(
+    {"request": None, "results": None, "message": None}
+)
+
 
 @router.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    """Простой рут для HTML-страницы поиска."""
-    return templates.TemplateResponse("index.html", {"request": request})
+    """Простой рут для HTML-страницы поиска (отдаём готовый HTML без Jinja)."""
+    return HTMLResponse(content=_INDEX_HTML)
 
 
 @router.get("/search", response_class=HTMLResponse)
-async def search_endpoint(request: Request, search: Optional[str] = None):
+async def search_endpoint(
+    request: Request,
+    search: Optional[str] = None,
+    df: pd.DataFrame = Depends(get_dataframe),
+):
     """HTML-эндпойнт для поиска (форма на сайте)."""
-    df = get_dataframe()
-
     if not search or not search.strip():
         return templates.TemplateResponse(
             "index.html",
@@ -35,14 +44,21 @@ async def search_endpoint(request: Request, search: Optional[str] = None):
             },
         )
 
-    result_df = search_dataframe(df, search)
+    # поиск — CPU-bound pandas/fuzzy, уводим из event loop
+    result_df = await asyncio.to_thread(search_dataframe, df, search)
 
     # финальный список полей в HTML
     if result_df.empty:
         results: List[Dict] = []
     else:
-        cols = [c for c in ['code', 'name', 'barcode', 'Score'] if c in result_df.columns]
-        results = result_df[cols].head(300).to_dict(orient="records")
+        # собираем записи из numpy-колонок: быстрее, чем to_dict(records)
+        top = result_df.head(300)
+        cols = {
+            c: top[c].to_numpy()
+            for c in ('code', 'name', 'barcode', 'Score')
+            if c in top.columns
+        }
+        results = [dict(zip(cols, row)) for row in zip(*cols.values())]
 
     return templates.TemplateResponse(
         "index.html",
@@ -50,53 +66,39 @@ async def search_endpoint(request: Request, search: Optional[str] = None):
     )
 
 
-@router.get("/query", response_class=JSONResponse)
-async def query_endpoint(request: Request, q: Optional[str] = None, producerids: Optional[str] = None):
+@router.get("/query", response_class=ORJSONResponse)
+async def query_endpoint(
+    request: Request,
+    q: Optional[str] = None,
+    producerids: Optional[str] = None,
+    df: pd.DataFrame = Depends(get_dataframe),
+):
     if q is None or not q.strip():
         raise HTTPException(status_code=400, detail="Query parameter 'q' is required.")
 
-    df = get_dataframe()
-
+    producer_ids = None
     if producerids:
         try:
-            producer_ids = [int(num) for num in producerids.split(",") if str(num).strip().isdigit()]
+            producer_ids = tuple(
+                int(num) for num in producerids.split(",") if str(num).strip().isdigit()
+            )
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid 'producerids' format.")
-        if "producerid" in df.columns:
-            df = df[df["producerid"].isin(producer_ids)]
-
-    result_df = search_dataframe(df, q)
-
-    if result_df.empty:
-        ids = None
-    else:
-        if "id" not in result_df.columns:
-            raise HTTPException(status_code=500, detail="Dataframe does not contain 'id' column.")
-
-        raw_ids = [item["id"] for item in result_df.to_dict(orient="records")]
+        # параметр передан, но ни одного id не распарсилось — это ошибка
+        # запроса, а не «без фильтра»
+        if not producer_ids:
+            raise HTTPException(status_code=400, detail="Invalid 'producerids' format.")
 
-        seen = set()
-        unique_ids = []
-        for x in raw_ids:
-            key = x
-            try:
-                key = int(x)
-            except Exception:
-                pass
-            if key in seen:
-                continue
-            seen.add(key)
-            unique_ids.append(key)
-            if len(unique_ids) >= 96:
-                break
+    # кешируемый поиск: повторный запрос — O(1) вместо fuzzy-конвейера
+    all_ids = await asyncio.to_thread(search_ids, df, q, producer_ids)
 
-        ids = unique_ids
+    ids = list(all_ids[:96]) if all_ids else None
 
-    return JSONResponse(content={"message": "ok", "data": ids})
+    return ORJSONResponse(content={"message": "ok", "data": ids})
 
 
 @router.post("/batch_query")
-async def batch_query(request: Request):
+async def batch_query(request: Request, df: pd.DataFrame = Depends(get_dataframe)):
     payload = await request.json()
     items = payload.get("items")
 
@@ -108,58 +110,51 @@ async def batch_query(request: Request):
 
     producerids = payload.get("producerids")
 
-    df = get_dataframe()
-
     if producerids:
         producer_ids = [
             int(num)
             for num in str(producerids).split(",")
             if str(num).strip().isdigit()
         ]
-        df_filtered_base = df[df["producerid"].isin(producer_ids)]
+        if not producer_ids:
+            raise HTTPException(
+                status_code=400, detail="Invalid 'producerids' format."
+            )
+        df_filtered_base = filter_by_producer_ids(df, producer_ids)
     else:
         df_filtered_base = df
 
-    results = []
+    # все валидные запросы батча считаем одним вызовом:
+    # fuzzy-варианты уходят в rapidfuzz.process.cdist целиком
+    valid_positions = [
+        i for i, q in enumerate(items) if isinstance(q, str) and q.strip()
+    ]
+    frames = await asyncio.to_thread(
+        search_many, df_filtered_base, [items[i] for i in valid_positions]
+    )
+
+    results = [{"query": q, "data": None, "name": None} for q in items]
 
-    for q in items:
-        if not isinstance(q, str) or not q.strip():
-            results.append({"query": q, "data": None, "name": None})
+    for position, result_df in zip(valid_positions, frames):
+        if result_df is None or result_df.empty:
             continue
 
-        # используем общий движок поиска с синонимами/фаззи/бустами
-        result_df = search_dataframe(df_filtered_base, q)
+        top_row = result_df.iloc[0]
 
-        if result_df is None or result_df.empty:
-            data = None
-            name = None
-        else:
-            top_row = result_df.iloc[0]
-
-            top_id = None
-            if "id" in result_df.columns:
-                try:
-                    # приводим numpy.int64 -> обычный int
-                    top_id = int(top_row["id"])
-                except (TypeError, ValueError):
-                    top_id = None
-
-            data = [top_id] if top_id is not None else None
-
-            if "name" in result_df.columns:
-                name = str(top_row["name"])
-            else:
-                name = None
-
-        results.append(
-            {
-                "query": q,
-                "data": data,
-                "name": name,
-            }
-        )
+        top_id = None
+        if "id" in result_df.columns:
+            try:
+                # приводим numpy.int64 -> обычный int
+                top_id = int(top_row["id"])
+            except (TypeError, ValueError):
+                top_id = None
+
+        results[position]["data"] = [top_id] if top_id is not None else None
+
+        if "name" in result_df.columns:
+            results[position]["name"] = str(top_row["name"])
 
-    return JSONResponse(
+    return ORJSONResponse(
         content={
             "message": "ok",
             "results": results,
@@ -1,5 +1,163 @@
+import os
+import re
+
+import numpy as np
 import pandas as pd
 
+# токенизация названий для set-based бустов: слова и максимальные
+# последовательности цифр (совпадают с \b- и lookaround-семантикой
+# паттернов в apply_token_boosts)
+_WORD_RE = re.compile(r'\w+')
+_NUMBER_RE = re.compile(r'\d+')
+
+DATA_FILE = 'my_data_file.csv'
+# parquet-копия той же выгрузки (пишется updatedb.py рядом с CSV):
+# читается без парсинга текста, строки приходят готовыми Arrow-буферами
+PARQUET_FILE = 'data.parquet'
+
+# строковые колонки загружаем сразу как string[pyarrow]:
+# ни один запрос больше не делает astype(str) на всю колонку,
+# штрихкоды не превращаются во float при пропусках,
+# а .str.lower()/.str.contains работают на Arrow-ядрах без
+# объектов-строк Python на каждое значение
+_STRING_COLUMNS = {
+    'code': 'string[pyarrow]',
+    'name': 'string[pyarrow]',
+    'barcode': 'string[pyarrow]',
+}
+
+# Кеш DataFrame: файл перечитывается только при изменении mtime,
+# предвычисления делаются один раз на загрузку, а не на запрос
+_df_cache = None
+_df_mtime = None
+_df_version = 0
+
+# Позиционные индексы (producer_index, code_exact, barcode_exact) живут
+# вне df.attrs: numpy-массивы в attrs ломают pd.concat срезов
+# (сравнение attrs даёт "truth value of an array is ambiguous").
+# Ключ — скалярный df.attrs['version'], он переживает любые срезы.
+_position_indexes: dict = {}
+
+
+def get_position_indexes(df):
+    """Индексы позиций для подготовленного df (None — df не из get_dataframe)."""
+    entry = _position_indexes.get(df.attrs.get('version'))
+    if entry is None or entry['len'] != len(df):
+        return None
+    return entry
+
+
+def _prepare_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """Предвычисления по колонке name: lower-список и множества токенов."""
+    # сжимаем числовые колонки до int32: вдвое меньше байт в сортировках
+    # и индексах (Score при этом остаётся int32 — int8 переполняется
+    # на сумме бустов, см. apply_token_boosts)
+    if 'id' in df.columns:
+        df['id'] = df['id'].astype(np.int32)
+    if 'producerid' in df.columns:
+        # пропуски producerid -> 0 (несуществующий id), чтобы не тянуть float64
+        df['producerid'] = df['producerid'].fillna(0).astype(np.int32)
+
+
+    if 'name' in df.columns:
+        name_lc = df['name'].str.lower().tolist()
+    else:
+        name_lc = []
+    df.attrs['name_lc'] = name_lc
+    df.attrs['name_word_tokens'] = [
+        frozenset(_WORD_RE.findall(value)) for value in name_lc
+    ]
+    df.attrs['name_number_tokens'] = [
+        frozenset(_NUMBER_RE.findall(value)) for value in name_lc
+    ]
+    df.attrs['token_index_len'] = len(df)
+
+    indexes = {'len': len(df)}
+
+    # producerid -> позиции строк: фильтр за O(|producer_ids|) вместо isin-скана
+    if 'producerid' in df.columns:
+        indexes['producer_index'] = df.groupby('producerid').indices
+
+    # точное значение code/barcode -> позиция строки (O(1) вместо fuzzy)
+    for column in ('code', 'barcode'):
+        if column in df.columns:
+            # значение -> все позиции строк: штрихкод может повторяться
+            # у нескольких товаров, берём их все, а не последний
+            index = {}
+            for position, value in enumerate(df[column].str.lower()):
+                if value:
+                    index.setdefault(value, []).append(position)
+            indexes[f'{column}_exact'] = {
+                value: np.asarray(positions, dtype=np.intp)
+                for value, positions in index.items()
+            }
+
+    _position_indexes.clear()
+    _position_indexes[df.attrs['version']] = indexes
+
+    return df
+
+
+def filter_by_producer_ids(df, producer_ids):
+    """Фильтр по producerid через готовый индекс позиций, без isin-скана."""
+    if producer_ids is None or 'producerid' not in df.columns:
+        return df
+    if not producer_ids:
+        # фильтр передан, но пустой — это «ничего», а не «без фильтра»
+        return df.iloc[[]]
+
+    indexes = get_position_indexes(df)
+    index = indexes.get('producer_index') if indexes is not None else None
+    if index is None:
+        # df не из get_dataframe() (или уже отфильтрован) — обычный путь
+        return df[df['producerid'].isin(producer_ids)]
+
+    rows = [index[p] for p in producer_ids if p in index]
+    if not rows:
+        return df.iloc[[]]
+
+    positions = np.sort(np.concatenate(rows))
+    return df.iloc[positions]
+
+
 # Load data into DataFrame
 def get_dataframe():
-    return pd.read_csv('my_data_file.csv')
\ No newline at end of file
+    global _df_cache, _df_mtime, _df_version
+
+    try:
+        csv_mtime = os.path.getmtime(DATA_FILE)
+    except OSError:
+        csv_mtime = None
+    try:
+        parquet_mtime = os.path.getmtime(PARQUET_FILE)
+    except OSError:
+        parquet_mtime = None
+
+    # предпочитаем parquet, если он не старее CSV (обе копии пишет updatedb.py)
+    use_parquet = parquet_mtime is not None and (
+        csv_mtime is None or parquet_mtime >= csv_mtime
+    )
+    mtime = parquet_mtime if use_parquet else csv_mtime
+
+    if _df_cache is None or mtime != _df_mtime:
+        if use_parquet:
+            df = pd.read_parquet(PARQUET_FILE, engine='pyarrow')
+            for column, dtype in _STRING_COLUMNS.items():
+                if column in df.columns:
+                    df[column] = df[column].astype(dtype)
+        else:
+            df = pd.read_csv(DATA_FILE, dtype=_STRING_COLUMNS)
+        for column in _STRING_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].fillna('')
+        _df_version += 1
+        df.attrs['version'] = _df_version
+        _df_cache = _prepare_dataframe(df)
+        _df_mtime = mtime
+
+        # новые данные — старые результаты поиска невалидны
+        # (импорт внутри: functions импортирует database на уровне модуля)
+        from app.functions import clear_search_cache
+        clear_search_cache()
+
+    return _df_cache
@@ -1,14 +1,22 @@
+import bisect
 import os
 import re
 import json
 import time
 import urllib.request
+from collections import Counter, OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 
+import ahocorasick
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from rapidfuzz import fuzz, process
 
+from app.database import filter_by_producer_ids, get_position_indexes
 from app.helpers import (
     english_to_russian_transliteration_dict,
     russian_to_english_transliteration_dict,
@@ -25,6 +33,8 @@ PHRASE_MATCH_BOOST = 15    # +15 если весь запрос как подс
 WORD_MISSING_PENALTY = 3   # -3 за каждое слово из запроса, которого нет в названии
 NUMBER_MISSING_PENALTY = 10  # -10 за каждое число из запроса, которого нет в названии
 FULL_WORDS_MATCH_BONUS = 25  # +25 если все слова запроса присутствуют в названии
+EXACT_MATCH_SCORE = 150      # точное совпадение кода/штрихкода
+PHRASE_SHORTCUT_MIN_HITS = 20  # столько точных фразовых совпадений отменяют fuzzy
 
 STOP_WORDS = {
     "для",
@@ -53,6 +63,13 @@ PRODUCT_TYPE_GROUPS = [
     {"conditioner", "кондиционер"},
 ]
 
+# Паттерны normalize_query, скомпилированные один раз при импорте
+_PUNCT_RE = re.compile(r"[^\w\s\.]+")
+_WS_RE = re.compile(r"\s+")
+
+# токен с таким символом не представим в \w+-множествах name_word_tokens
+_NON_WORD_CHAR_RE = re.compile(r"\W", re.UNICODE)
+
 # Путь к файлу синонимов (можно переопределить через переменную окружения)
 SYNONYMS_PATH = Path(os.getenv("SEARCH_SYNONYMS_PATH", "synonyms.json"))
 SYNONYMS_URL = os.getenv("SEARCH_SYNONYMS_URL", "https://nest.sellwin.by/ocr-ai-settings/all")
@@ -63,6 +80,182 @@ _synonyms_cache: Dict[str, List[str]] = {}
 _synonyms_mtime: Optional[float] = None
 _synonyms_last_fetch: Optional[float] = None
 
+# версия словаря синонимов: растёт при каждом реальном изменении
+# содержимого и входит в ключ кеша замен
+_synonyms_version = 0
+
+# Инвалидация кеша синонимов: при наличии watchdog файл отслеживается
+# по событиям ФС и stat() на каждый запрос не нужен; без watchdog
+# stat() троттлится до одного раза в интервал
+_synonyms_dirty = True
+_synonyms_watch_started = False
+_synonyms_last_stat = 0.0
+_SYNONYMS_STAT_INTERVAL = float(os.getenv("SEARCH_SYNONYMS_STAT_INTERVAL", "1.0"))
+
+
+def _start_synonyms_watcher() -> bool:
+    """Запускаем наблюдатель за synonyms.json; False — watchdog недоступен."""
+    global _synonyms_watch_started
+
+    if _synonyms_watch_started:
+        return True
+
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return False
+
+    # сравниваем только абсолютные пути: watchdog отдаёт пути относительно
+    # наблюдаемой директории, и относительный SYNONYMS_PATH с ними не совпал бы
+    target = str(SYNONYMS_PATH.resolve())
+    directory = SYNONYMS_PATH.resolve().parent
+    if not directory.is_dir():
+        return False
+
+    class _SynonymsHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            global _synonyms_dirty
+            for event_path in (
+                getattr(event, "src_path", None),
+                getattr(event, "dest_path", None),
+            ):
+                if event_path and os.path.abspath(event_path) == target:
+                    _synonyms_dirty = True
+                    return
+
+    observer = Observer()
+    observer.daemon = True
+    observer.schedule(_SynonymsHandler(), str(directory))
+    observer.start()
+    _synonyms_watch_started = True
+    return True
+
+# Кеши, ключуемые id() объекта, держат сам объект в записи: пока запись
+# жива, id не может достаться другому объекту, поэтому кадр-однодневка с
+# тем же адресом и длиной никогда не получит чужие данные (len-проверки
+# одной недостаточно — она не подтверждает identity).
+
+# Кеш Aho-Corasick автомата для числовой ветки: id(df) -> (df, automaton)
+_digit_automaton_cache: Dict[int, Any] = {}
+
+# Кеш лосвеченных (lower) колонок: id(df) -> (df, {column: list[str]})
+_lowered_columns_cache: Dict[int, Any] = {}
+
+# Кеш длин значений после token-sort-нормализации: id(списка) -> (список, массив)
+_token_sort_lengths_cache: Dict[int, Any] = {}
+
+
+def _token_sort_lengths(col_values: List[str]) -> np.ndarray:
+    """
+    Длина каждого значения после схлопывания пробелов — ровно та строка,
+    которую сравнивает fuzz.token_sort_ratio. Считается один раз на
+    список значений.
+    """
+    key = id(col_values)
+    cached = _token_sort_lengths_cache.get(key)
+    if cached is None or cached[0] is not col_values:
+        cached = (
+            col_values,
+            np.fromiter(
+                (len(" ".join(value.split())) for value in col_values),
+                dtype=np.int64,
+                count=len(col_values),
+            ),
+        )
+        _token_sort_lengths_cache.clear()
+        _token_sort_lengths_cache[key] = cached
+    return cached[1]
+
+
+def _get_lowered_values(df: pd.DataFrame, column: str) -> List[str]:
+    """
+    Значения колонки, приведённые к lower, считаются один раз на объект
+    DataFrame; дальше сканируем готовый список без astype/str.lower.
+    """
+    # get_dataframe() кладёт готовый список в attrs при загрузке данных
+    if column == "name":
+        prepared = df.attrs.get("name_lc")
+        if prepared is not None and len(prepared) == len(df):
+            return prepared
+
+    key = id(df)
+    cached = _lowered_columns_cache.get(key)
+    if cached is None or cached[0] is not df:
+        cached = (df, {})
+        _lowered_columns_cache.clear()
+        _lowered_columns_cache[key] = cached
+
+    columns = cached[1]
+    if column not in columns:
+        # колонки загружаются строковыми (get_dataframe), лишний astype
+        # пересобирал бы всю колонку в object
+        columns[column] = df[column].str.lower().tolist()
+    return columns[column]
+
+
+# Кеш Arrow-массивов по lower-спискам: id(списка) -> (список, pa.Array)
+_arrow_values_cache: Dict[int, Any] = {}
+
+
+def _contains_mask(values: List[str], needle: str) -> np.ndarray:
+    """
+    Булева маска "needle — подстрока значения" по списку строк.
+
+    Литеральный поиск уводим в pyarrow.compute.match_substring: скан идёт
+    по упакованным Arrow-буферам в C++ без PyUnicode на строку. Regex
+    сюда не попадает (его Arrow-движок ломает \\b на кириллице) — это
+    только про простое вхождение подстроки.
+    """
+    key = id(values)
+    cached = _arrow_values_cache.get(key)
+    if cached is None or cached[0] is not values:
+        # запись держит сам список: несколько живых записей — это
+        # code/name/barcode, а чужой список с тем же id невозможен
+        if len(_arrow_values_cache) > 8:
+            _arrow_values_cache.clear()
+        cached = (values, pa.array(values, type=pa.string()))
+        _arrow_values_cache[key] = cached
+
+    mask = pc.match_substring(cached[1], pattern=needle)
+    return mask.to_numpy(zero_copy_only=False)
+
+
+def _get_digit_automaton(df: pd.DataFrame) -> "ahocorasick.Automaton":
+    """
+    Автомат Aho-Corasick по значениям code/name/barcode (в lower),
+    каждому значению соответствует список позиций строк.
+
+    Строится один раз на объект DataFrame и переиспользуется,
+    пока get_dataframe() не вернёт новый объект.
+    """
+    key = id(df)
+    cached = _digit_automaton_cache.get(key)
+    if cached is not None and cached[0] is df:
+        return cached[1]
+
+    automaton = ahocorasick.Automaton()
+    for column in ("code", "name", "barcode"):
+        if column not in df.columns:
+            continue
+        values = _get_lowered_values(df, column)
+        for position, value in enumerate(values):
+            if not value or value == "nan":
+                continue
+            positions = automaton.get(value, None)
+            if positions is None:
+                automaton.add_word(value, [position])
+            else:
+                positions.append(position)
+
+    if len(automaton) > 0:
+        automaton.make_automaton()
+
+    # держим индекс только для актуального DataFrame
+    _digit_automaton_cache.clear()
+    _digit_automaton_cache[key] = (df, automaton)
+    return automaton
+
 
 # ---------------------------------------------------------
 # Вспомогательные функции: язык / раскладка / транслит
@@ -70,69 +263,93 @@ _synonyms_last_fetch: Optional[float] = None
 
 def detect_language(text: str) -> str:
     """Грубое определение языка: считаем кириллицу/латиницу."""
-    count_cyrillic = sum(1 for char in text if "\u0400" <= char <= "\u04FF")
-    count_latin = sum(1 for char in text if "a" <= char <= "z" or "A" <= char <= "Z")
+    if len(text) < 8:
+        # короткая строка: Python-цикл дешевле, чем заход в numpy
+        count_cyrillic = sum(1 for char in text if "\u0400" <= char <= "\u04FF")
+        count_latin = sum(
+            1 for char in text if "a" <= char <= "z" or "A" <= char <= "Z"
+        )
+        return "ru" if count_cyrillic >= count_latin else "en"
+
+    # один SIMD-проход по кодпоинтам вместо двух символьных циклов
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    count_cyrillic = int(((codes >= 0x0400) & (codes <= 0x04FF)).sum())
+    count_latin = int(
+        (((codes >= 0x61) & (codes <= 0x7A)) | ((codes >= 0x41) & (codes <= 0x5A))).sum()
+    )
     return "ru" if count_cyrillic >= count_latin else "en"
 
 
+# Таблицы соответствия раскладок, собранные один раз при импорте
+_RUSSIAN_LAYOUT = "йцукенгшщзхъфывапролджэячсмитьбюЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭЯЧСМИТЬБЮ"
+_ENGLISH_LAYOUT = "qwertyuiop[]asdfghjkl;'zxcvbnm,.QWERTYUIOP{}ASDFGHJKL:\"ZXCVBNM<>"
+_RU_TO_EN_LAYOUT = str.maketrans(_RUSSIAN_LAYOUT, _ENGLISH_LAYOUT)
+_EN_TO_RU_LAYOUT = str.maketrans(_ENGLISH_LAYOUT, _RUSSIAN_LAYOUT)
+
+
+@lru_cache(maxsize=8192)
 def convert_layout(text: str) -> str:
     """
     Конвертация раскладки (русская клавиатура <-> английская),
     не меняя сами символы (это не транслит).
-    """
-    russian_layout = "йцукенгшщзхъфывапролджэячсмитьбюЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭЯЧСМИТЬБЮ"
-    english_layout = "qwertyuiop[]asdfghjkl;'zxcvbnm,.QWERTYUIOP{}ASDFGHJKL:\"ZXCVBNM<>"
 
+    Один вызов str.translate: таблица затрагивает только символы своей
+    раскладки, остальные проходят без изменений (отдельная проверка
+    на кириллицу не нужна). Результат кешируется.
+    """
     if not text:
         return text
 
-    language = detect_language(text)
+    if detect_language(text) == "ru":
+        return text.translate(_RU_TO_EN_LAYOUT)
+    return text.translate(_EN_TO_RU_LAYOUT)
 
-    if language == "ru":
-        translation_table = str.maketrans(russian_layout, english_layout)
-        result_chars = []
-        for ch in text:
-            if "\u0400" <= ch <= "\u04FF":
-                result_chars.append(ch.translate(translation_table))
-            else:
-                result_chars.append(ch)
-        return "".join(result_chars)
 
-    translation_table = str.maketrans(english_layout, russian_layout)
-    return text.translate(translation_table)
+# Разобранный транслит-словарь: многосимвольные ключи — альтернацией
+# (длинные впереди, сохраняется longest-match), односимвольные — таблицей
+# str.translate; кешируется по id(словаря)
+_translit_parts_cache: Dict[int, Tuple[Optional["re.Pattern"], dict]] = {}
+
+
+def _get_translit_parts(transliteration_dict: dict) -> Tuple[Optional["re.Pattern"], dict]:
+    key = id(transliteration_dict)
+    parts = _translit_parts_cache.get(key)
+    if parts is None:
+        multi_keys = sorted(
+            (k for k in transliteration_dict if len(k) > 1), key=len, reverse=True
+        )
+        pattern = (
+            re.compile("|".join(map(re.escape, multi_keys))) if multi_keys else None
+        )
+        table = str.maketrans(
+            {k: v for k, v in transliteration_dict.items() if len(k) == 1}
+        )
+        parts = (pattern, table)
+        _translit_parts_cache[key] = parts
+    return parts
 
 
 def custom_transliterate(text: str, transliteration_dict: dict) -> str:
     """
     Транслит с поддержкой многосимвольных ключей словаря:
-    берём максимально возможную подстроку от текущей позиции.
+    сначала re.sub только по многосимвольным ключам (их единицы,
+    альтернация по убыванию длины — longest-match), затем один C-проход
+    str.translate по односимвольным. Направления словарей не пересекаются
+    (ключи и значения в разных алфавитах), поэтому второй проход не
+    трогает результат первого.
     """
-    if not text:
+    if not text or not transliteration_dict:
         return text
 
-    result = []
-    i = 0
-    max_key_len = max(map(len, transliteration_dict.keys())) if transliteration_dict else 0
-
-    while i < len(text):
-        match_found = False
-        max_len_here = min(len(text) - i, max_key_len)
-        for length in range(max_len_here, 0, -1):
-            chunk = text[i : i + length]
-            if chunk in transliteration_dict:
-                result.append(transliteration_dict[chunk])
-                i += length
-                match_found = True
-                break
-        if not match_found:
-            result.append(transliteration_dict.get(text[i], text[i]))
-            i += 1
-
-    return "".join(result)
+    pattern, table = _get_translit_parts(transliteration_dict)
+    if pattern is not None:
+        text = pattern.sub(lambda match: transliteration_dict[match.group(0)], text)
+    return text.translate(table)
 
 
+@lru_cache(maxsize=8192)
 def transliterate(text: Optional[str]) -> Optional[str]:
-    """Авто-определение направления транслита (ru->en или en->ru)."""
+    """Авто-определение направления транслита (ru->en или en->ru), с кешем."""
     if not isinstance(text, str) or not text:
         return None
 
@@ -213,7 +430,7 @@ def _load_synonyms() -> Dict[str, List[str]]:
     Можно править файл на лету: при изменении mtime кеш будет обновлён.
     При наличии URL (SEARCH_SYNONYMS_URL) словарь берётся оттуда с TTL.
     """
-    global _synonyms_cache, _synonyms_mtime, _synonyms_last_fetch
+    global _synonyms_cache, _synonyms_mtime, _synonyms_last_fetch, _synonyms_version
 
     path = SYNONYMS_PATH
 
@@ -234,16 +451,31 @@ def _load_synonyms() -> Dict[str, List[str]]:
                 return _synonyms_cache
         else:
             synonyms = _extract_synonyms_payload(payload)
+            if synonyms != _synonyms_cache:
+                _synonyms_version += 1
             _synonyms_cache = synonyms
             _synonyms_last_fetch = now
             _synonyms_mtime = None
             return _synonyms_cache
 
+    # watchdog помечает кеш устаревшим сразу по событию ФС, но троттленный
+    # stat() остаётся страховкой: пропущенное событие лишь отложит
+    # обновление до следующего интервала, а не заморозит кеш навсегда
+    global _synonyms_dirty, _synonyms_last_stat
+    _start_synonyms_watcher()
+    now = time.time()
+    if not _synonyms_dirty and now - _synonyms_last_stat < _SYNONYMS_STAT_INTERVAL:
+        return _synonyms_cache
+    _synonyms_last_stat = now
+
     # файла нет — очищаем кеш и возвращаем пустой словарь
     if not path.is_file():
+        if _synonyms_cache:
+            _synonyms_version += 1
         _synonyms_cache = {}
         _synonyms_mtime = None
         _synonyms_last_fetch = None
+        _synonyms_dirty = False
         return _synonyms_cache
 
     try:
@@ -254,6 +486,7 @@ def _load_synonyms() -> Dict[str, List[str]]:
 
     # файл не менялся — возвращаем кеш
     if _synonyms_mtime is not None and mtime == _synonyms_mtime:
+        _synonyms_dirty = False
         return _synonyms_cache
 
     # файл изменился или загружаем первый раз
@@ -264,9 +497,13 @@ def _load_synonyms() -> Dict[str, List[str]]:
         # если JSON битый — не роняем поиск, остаёмся на старом кеше
         return _synonyms_cache
 
-    _synonyms_cache = _normalize_synonyms(raw)
+    synonyms = _normalize_synonyms(raw)
+    if synonyms != _synonyms_cache:
+        _synonyms_version += 1
+    _synonyms_cache = synonyms
     _synonyms_mtime = mtime
     _synonyms_last_fetch = None
+    _synonyms_dirty = False
     return _synonyms_cache
 
 
@@ -301,6 +538,15 @@ def replace_synonyms_in_query(query: str) -> str:
     if not synonyms:
         return query
 
+    # версия словаря входит в ключ кеша: после обновления синонимов
+    # старые замены не переиспользуются
+    return _replace_synonyms_cached(query, _synonyms_version)
+
+
+@lru_cache(maxsize=8192)
+def _replace_synonyms_cached(query: str, version: int) -> str:
+    synonyms = _synonyms_cache
+
     tokens = re.split(r"\s+", query)
     result_tokens: List[str] = []
 
@@ -315,6 +561,7 @@ def replace_synonyms_in_query(query: str) -> str:
     return " ".join(result_tokens)
 
 
+@lru_cache(maxsize=8192)
 def normalize_query(raw_query: str) -> str:
     """
     Нормализация текста запроса:
@@ -332,8 +579,8 @@ def normalize_query(raw_query: str) -> str:
         return ""
 
     # оставляем только \w, пробелы и '.' (для оттенков 10.23 и т.п.)
-    q = re.sub(r"[^\w\s\.]+", " ", q)
-    q = re.sub(r"\s+", " ", q)
+    q = _PUNCT_RE.sub(" ", q)
+    q = _WS_RE.sub(" ", q)
 
     return q
 
@@ -342,11 +589,109 @@ def normalize_query(raw_query: str) -> str:
 # Базовые поисковые функции (RapidFuzz + простое совпадение)
 # ---------------------------------------------------------
 
+def _fuzzy_hits(
+    search_query: str,
+    col_values: List[str],
+    threshold: int = 40,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ядро fuzzy-поиска: (позиции, баллы) по списку lower-значений,
+    без материализации DataFrame на каждый вариант запроса.
+    """
+    empty = (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int64))
+
+    if not isinstance(search_query, str):
+        return empty
+
+    q = search_query.strip().lower()
+    if not q:
+        return empty
+
+    tokens = q.split()
+    scorer = fuzz.token_set_ratio if len(tokens) <= 2 else fuzz.token_sort_ratio
+    if len(tokens) >= 3:
+        threshold = max(threshold, 55)
+
+    # cdist считает весь столбец одним C++-вызовом (workers=-1 — все ядра);
+    # баллы ниже порога обнуляются прямо внутри rapidfuzz
+    scores = process.cdist(
+        [q],
+        col_values,
+        scorer=scorer,
+        score_cutoff=threshold,
+        workers=-1,
+        dtype=np.uint8,
+    )[0]
+
+    positions = np.flatnonzero(scores)
+    return positions, scores[positions].astype(np.int64)
+
+
+def _fuzzy_hits_batch(
+    variants: List[str],
+    col_values: List[str],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuzzy по всем вариантам запроса минимальным числом вызовов cdist:
+    варианты группируются по (scorer, порог), каждая группа считается
+    одной матрицей, на строку берётся максимум по всем вариантам.
+    """
+    groups: Dict[tuple, List[str]] = {}
+    for variant in variants:
+        scorer, threshold = _variant_scorer(variant)
+        groups.setdefault((scorer, threshold), []).append(variant)
+
+    best = np.zeros(len(col_values), dtype=np.uint8)
+    for (scorer, threshold), group in groups.items():
+        if scorer is fuzz.token_sort_ratio:
+            # префильтр по длине: лучший достижимый token_sort_ratio —
+            # 2*min(la,lb)/(la+lb)*100, строки вне окна не пройдут порог.
+            # Для token_set_ratio такой границы нет (подмножество слов
+            # даёт 100 при любой разнице длин), там фильтр не применяем.
+            lengths = _token_sort_lengths(col_values)
+            candidate = np.zeros(len(col_values), dtype=bool)
+            for variant in group:
+                query_len = len(" ".join(variant.split()))
+                candidate |= (
+                    200 * np.minimum(lengths, query_len)
+                    >= threshold * (lengths + query_len)
+                )
+            candidate_positions = np.flatnonzero(candidate)
+            if candidate_positions.size == 0:
+                continue
+            matrix = process.cdist(
+                group,
+                [col_values[i] for i in candidate_positions],
+                scorer=scorer,
+                score_cutoff=threshold,
+                workers=-1,
+                dtype=np.uint8,
+            )
+            best[candidate_positions] = np.maximum(
+                best[candidate_positions], matrix.max(axis=0)
+            )
+            continue
+
+        matrix = process.cdist(
+            group,
+            col_values,
+            scorer=scorer,
+            score_cutoff=threshold,
+            workers=-1,
+            dtype=np.uint8,
+        )
+        np.maximum(best, matrix.max(axis=0), out=best)
+
+    positions = np.flatnonzero(best)
+    return positions, best[positions].astype(np.int64)
+
+
 def search_with_fuzzy(
     search_query: str,
     dataframe: pd.DataFrame,
     column_name: str = "name",
     threshold: int = 40,   # было 65, делаем мягче
+    col_values: Optional[List[str]] = None,
 ) -> pd.DataFrame:
     """
     Fuzzy-поиск по RapidFuzz с учётом многословных запросов.
@@ -358,42 +703,94 @@ def search_with_fuzzy(
     И запрос, и значения колонки приводим к lower(),
     чтобы "6rc" совпадал с "6RC", "SoColor" с "socolor" и т.п.
     """
-    if not isinstance(search_query, str):
+    if column_name not in dataframe.columns:
         return pd.DataFrame(columns=list(dataframe.columns) + ["Score"])
 
-    q = search_query.strip().lower()
-    if not q:
-        return pd.DataFrame(columns=list(dataframe.columns) + ["Score"])
+    # lower-значения либо переданы вызывающим (один список на все
+    # варианты запроса), либо берутся из кеша по id(df)
+    if col_values is None:
+        col_values = _get_lowered_values(dataframe, column_name)
 
-    if column_name not in dataframe.columns:
+    positions, scores = _fuzzy_hits(search_query, col_values, threshold)
+    if positions.size == 0:
         return pd.DataFrame(columns=list(dataframe.columns) + ["Score"])
 
-    # главное отличие — .str.lower()
-    col_values = dataframe[column_name].astype(str).str.lower().tolist()
+    result_df = dataframe.iloc[positions].copy()
+    result_df["Score"] = scores.astype(np.int32, copy=False)
 
-    tokens = q.split()
-    scorer = fuzz.token_set_ratio if len(tokens) <= 2 else fuzz.token_sort_ratio
-    if len(tokens) >= 3:
-        threshold = max(threshold, 55)
+    return result_df
 
-    matches = process.extract(
-        q,
-        col_values,
-        scorer=scorer,
-        score_cutoff=threshold,
-        limit=None,
+
+@lru_cache(maxsize=4096)
+def _word_pattern(q: str, is_digit: bool) -> "re.Pattern":
+    """Скомпилированный паттерн полного слова (числа — отдельным токеном)."""
+    if is_digit:
+        return re.compile(fr"(?<![\d.])\b{q}\b(?![\d.])")
+    return re.compile(fr"\b{re.escape(q)}\b")
+
+
+def _simple_search_positions(search_query: str, dataframe: pd.DataFrame) -> np.ndarray:
+    """
+    Позиции строк с точным вхождением слова в name (ядро simple_search):
+    возвращает массив позиций, не материализуя DataFrame.
+    """
+    if not isinstance(search_query, str):
+        return np.empty(0, dtype=np.intp)
+
+    q = search_query.strip()
+    if not q or "name" not in dataframe.columns:
+        return np.empty(0, dtype=np.intp)
+
+    # кешированный скомпилированный паттерн по lower-значениям:
+    # без повторной компиляции на запрос и без различий движков regex
+    # (re2 сюда не тянем — паттерны тривиальны, бэктрекинга нет)
+    pattern = _word_pattern(q if q.isdigit() else q.lower(), q.isdigit())
+
+    name_values = _get_lowered_values(dataframe, "name")
+    mask = np.fromiter(
+        (pattern.search(value) is not None for value in name_values),
+        dtype=bool,
+        count=len(name_values),
     )
+    return np.flatnonzero(mask)
 
-    if not matches:
-        return pd.DataFrame(columns=list(dataframe.columns) + ["Score"])
 
-    indices = [m[2] for m in matches]
-    scores = [m[1] for m in matches]
+# Префиксный индекс по name: id(df) -> (len(df), сорт. значения, позиции)
+_name_prefix_cache: Dict[int, Any] = {}
 
-    result_df = dataframe.iloc[indices].copy()
-    result_df["Score"] = [int(s) for s in scores]
 
-    return result_df
+def _prefix_search_positions(search_query: str, dataframe: pd.DataFrame) -> np.ndarray:
+    """
+    Позиции строк, name которых начинается с запроса: бинарный поиск
+    по отсортированному lower-списку вместо скана всей колонки.
+    Дополняет словарный поиск (тот требует границу слова и не находит
+    недопечатанное "шамп" в начале названия).
+    """
+    q = search_query.strip().lower()
+    if not q or "name" not in dataframe.columns:
+        return np.empty(0, dtype=np.intp)
+
+    # ключ — версия данных, а не id(dataframe): сюда приходит свежая
+    # проекция _slim_view на каждый запрос, и id-ключ пересобирал бы
+    # индекс каждый раз. Кешируем только канонический кадр: версию
+    # наследуют и отфильтрованные срезы, и два разных фильтра одной
+    # длины взяли бы индекс друг друга
+    canonical = get_position_indexes(dataframe) is not None
+    key = (dataframe.attrs.get("version"), len(dataframe))
+    cached = _name_prefix_cache.get(key) if canonical else None
+    if cached is None:
+        name_values = _get_lowered_values(dataframe, "name")
+        order = sorted(range(len(name_values)), key=name_values.__getitem__)
+        sorted_values = [name_values[i] for i in order]
+        cached = (sorted_values, np.asarray(order, dtype=np.intp))
+        if canonical:
+            _name_prefix_cache.clear()
+            _name_prefix_cache[key] = cached
+
+    sorted_values, order = cached
+    lo = bisect.bisect_left(sorted_values, q)
+    hi = bisect.bisect_left(sorted_values, q + "\U0010ffff", lo=lo)
+    return np.sort(order[lo:hi])
 
 
 def simple_search(search_query: str, dataframe: pd.DataFrame) -> pd.DataFrame:
@@ -401,29 +798,62 @@ def simple_search(search_query: str, dataframe: pd.DataFrame) -> pd.DataFrame:
     Простой поиск по полному слову в name (без fuzzy):
     - для чисел матчим как отдельный токен, а не часть другой цифры.
     """
-    if not isinstance(search_query, str):
+    positions = _simple_search_positions(search_query, dataframe)
+    if positions.size == 0:
         return pd.DataFrame(columns=list(dataframe.columns) + ["Score"])
 
-    q = search_query.strip()
-    if not q or "name" not in dataframe.columns:
-        return pd.DataFrame(columns=list(dataframe.columns) + ["Score"])
+    result = dataframe.iloc[positions].copy()
+    result["Score"] = np.full(positions.size, 100, dtype=np.int32)
+    return result
 
-    name_series = dataframe["name"].astype(str)
 
-    if q.isdigit():
-        pattern = fr"(?<![\d.])\b{q}\b(?![\d.])"
-        mask = name_series.str.contains(pattern, case=False, na=False, regex=True)
-    else:
-        pattern = fr"\b{re.escape(q)}\b"
-        mask = name_series.str.contains(pattern, case=False, na=False, regex=True)
+# Кеш позиций "топовых" товаров: id(df) -> (df, {num: [массивы позиций]})
+_top_product_index_cache: Dict[int, Any] = {}
 
-    result = dataframe[mask].copy()
-    if result.empty:
-        return pd.DataFrame(columns=list(dataframe.columns) + ["Score"])
 
-    result["Score"] = 100
-    result["Score"] = result["Score"].astype(int)
-    return result
+def _get_top_product_index(df: pd.DataFrame) -> Dict[int, List[np.ndarray]]:
+    """
+    Позиции строк для каждого значения top_product_list: один проход
+    Aho-Corasick по всем названиям сразу (вместо regex-скана на каждое
+    значение), границы слов проверяются по соседним символам.
+    Строится один раз на объект DataFrame.
+    """
+    key = id(df)
+    cached = _top_product_index_cache.get(key)
+    if cached is not None and cached[0] is df:
+        return cached[1]
+
+    automaton = ahocorasick.Automaton()
+    value_ids: Dict[str, int] = {}
+    for names in top_product_list.values():
+        for value in names:
+            lowered = value.lower()
+            if lowered not in value_ids:
+                value_ids[lowered] = len(value_ids)
+                automaton.add_word(lowered, (value_ids[lowered], lowered))
+    automaton.make_automaton()
+
+    hits: List[List[int]] = [[] for _ in value_ids]
+    name_values = _get_lowered_values(df, "name")
+    for position, name in enumerate(name_values):
+        for end, (value_id, value) in automaton.iter(name):
+            start = end - len(value) + 1
+            if (start == 0 or not _is_word_char(name[start - 1])) and (
+                end == len(name) - 1 or not _is_word_char(name[end + 1])
+            ):
+                hits[value_id].append(position)
+
+    index = {
+        num: [
+            np.asarray(hits[value_ids[value.lower()]], dtype=np.intp)
+            for value in names
+        ]
+        for num, names in top_product_list.items()
+    }
+
+    _top_product_index_cache.clear()
+    _top_product_index_cache[key] = (df, index)
+    return index
 
 
 def top_number_search(search_query: str, dataframe: pd.DataFrame) -> pd.DataFrame:
@@ -439,30 +869,121 @@ def top_number_search(search_query: str, dataframe: pd.DataFrame) -> pd.DataFram
     if num not in top_product_list:
         return result_df
 
-    frames = []
-    for value in top_product_list[num]:
-        mask = dataframe["name"].astype(str).str.contains(
-            fr"\b{re.escape(value)}\b", case=False, na=False
-        )
-        tmp = dataframe[mask].copy()
-        if tmp.empty:
-            continue
-        tmp["Score"] = 101
-        tmp["Score"] = tmp["Score"].astype(int)
-        frames.append(tmp)
+    index = _get_top_product_index(dataframe)
 
-    if not frames:
+    position_arrays = [p for p in index.get(num, []) if p.size]
+    if not position_arrays:
         return result_df
 
-    return pd.concat(frames, ignore_index=True)
+    # один общий iloc вместо concat по срезам: срезы тянут attrs,
+    # а их сравнение в concat ломается на numpy-значениях
+    positions = np.concatenate(position_arrays)
+    result_df = dataframe.iloc[positions].reset_index(drop=True)
+    result_df["Score"] = np.full(positions.size, 101, dtype=np.int32)
+    return result_df
 
 
 def merge_and_sort_dataframes(*dataframes: pd.DataFrame) -> pd.DataFrame:
-    """Безопасный concat нескольких результатов."""
+    """
+    Сведение нескольких результатов: на каждый id остаётся строка с
+    максимальным Score, итог отсортирован по Score по убыванию.
+
+    Дубли отбрасываются по numpy-массивам id/Score до материализации,
+    поэтому concat собирает только выжившие строки (а не сумму размеров
+    всех источников, как раньше).
+    """
     frames = [df for df in dataframes if isinstance(df, pd.DataFrame) and not df.empty]
     if not frames:
         return pd.DataFrame()
-    return pd.concat(frames, ignore_index=True)
+
+    if any("id" not in f.columns or "Score" not in f.columns for f in frames):
+        # без id/Score сводить нечего — старое поведение
+        return pd.concat(frames, ignore_index=True)
+
+    ids = np.concatenate([f["id"].to_numpy() for f in frames])
+    scores = np.concatenate(
+        [f["Score"].to_numpy(dtype=np.int32, copy=False) for f in frames]
+    )
+    frame_of = np.concatenate(
+        [np.full(len(f), i, dtype=np.intp) for i, f in enumerate(frames)]
+    )
+    row_of = np.concatenate([np.arange(len(f), dtype=np.intp) for f in frames])
+
+    # сортировка по (id, -Score): первая запись каждого id — максимум
+    order = np.lexsort((-scores, ids))
+    sorted_ids = ids[order]
+    keep = np.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1]))
+    kept = order[keep]
+    # итоговый порядок — по убыванию Score
+    kept = kept[np.argsort(-scores[kept], kind="stable")]
+
+    kept_frame = frame_of[kept]
+    kept_row = row_of[kept]
+    parts = []
+    for i in range(len(frames)):
+        rows = kept_row[kept_frame == i]
+        if rows.size:
+            part = frames[i].iloc[rows]
+            # срезы наследуют attrs исходного df; с ними concat падает
+            # на сравнении numpy-значений — собираем части без attrs
+            part.attrs = {}
+            parts.append(part)
+    combined = pd.concat(parts, ignore_index=True)
+
+    # после пофреймовой сборки восстанавливаем порядок по Score
+    final_order = np.argsort(
+        -combined["Score"].to_numpy(dtype=np.int32, copy=False), kind="stable"
+    )
+    return combined.iloc[final_order].reset_index(drop=True)
+
+
+def _merge_hit_arrays(
+    positions_list: List[np.ndarray],
+    scores_list: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Сведение (позиции, баллы) нескольких источников: на каждую позицию
+    остаётся максимальный Score. Чистый numpy, без DataFrame.
+    """
+    positions = np.concatenate(positions_list)
+    scores = np.concatenate(scores_list)
+    if positions.size == 0:
+        return positions, scores
+
+    # сортировка по (позиция, -Score): первая запись позиции — максимум
+    order = np.lexsort((-scores, positions))
+    positions = positions[order]
+    scores = scores[order]
+    keep = np.concatenate(([True], positions[1:] != positions[:-1]))
+    return positions[keep], scores[keep]
+
+
+def merge_hits(df: pd.DataFrame, *frames: pd.DataFrame) -> pd.DataFrame:
+    """
+    Объединение результатов поиска без pd.concat: метки строк и Score
+    собираются в numpy-массивы, на каждую строку берётся максимальный
+    Score, итог материализуется из исходного df один раз.
+
+    Все frames должны быть срезами одного и того же df
+    (метки индекса совпадают с метками df).
+    """
+    useful = [f for f in frames if isinstance(f, pd.DataFrame) and not f.empty]
+    if not useful:
+        return pd.DataFrame()
+
+    labels, scores = _merge_hit_arrays(
+        [f.index.to_numpy() for f in useful],
+        [
+            f["Score"].to_numpy()
+            if "Score" in f.columns
+            else np.zeros(len(f), dtype=np.int64)
+            for f in useful
+        ],
+    )
+
+    result = df.loc[labels].copy()
+    result["Score"] = scores.astype(np.int32, copy=False)
+    return result
 
 
 def sort_dataframes(df: pd.DataFrame) -> pd.DataFrame:
@@ -470,13 +991,17 @@ def sort_dataframes(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty:
         return pd.DataFrame(columns=getattr(df, "columns", []))
 
-    result = df.copy()
+    # argsort по numpy-массиву + маска дублей: один gather вместо
+    # копии кадра, сортировки pandas и второго прохода drop_duplicates
+    result = df
     if "Score" in result.columns:
-        result["Score"] = result["Score"].astype(int)
-        result.sort_values(by="Score", ascending=False, inplace=True)
+        order = np.argsort(
+            -result["Score"].to_numpy(dtype=np.int32, copy=False), kind="stable"
+        )
+        result = result.iloc[order]
 
     if "id" in result.columns:
-        result.drop_duplicates(subset="id", inplace=True)
+        result = result[~result["id"].duplicated()]
 
     return result
 
@@ -485,6 +1010,125 @@ def sort_dataframes(df: pd.DataFrame) -> pd.DataFrame:
 # Бусты по совпадениям слов и чисел из исходного запроса
 # ---------------------------------------------------------
 
+def _is_word_char(char: str) -> bool:
+    """Аналог \\w: буква/цифра/подчёркивание."""
+    return char.isalnum() or char == "_"
+
+
+def _count_token_hits(
+    name_low_values: List[str],
+    words: List[str],
+    numbers: set,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Считает совпадения токенов запроса в каждом имени одним проходом
+    Aho-Corasick вместо K regex-проходов на имя.
+
+    Семантика совпадает с прежними паттернами:
+    - слово: границы \\b с обеих сторон;
+    - число: соседние символы — не цифры (lookaround-правило);
+    - каждый различный токен засчитывается один раз на имя.
+    """
+    n_rows = len(name_low_values)
+    word_hits = np.zeros(n_rows, dtype=np.int64)
+    num_hits = np.zeros(n_rows, dtype=np.int64)
+
+    distinct = set(words) | numbers
+    if not distinct:
+        return word_hits, num_hits
+
+    # повторы слова в запросе бустятся столько же раз, сколько раньше
+    word_counts = Counter(words)
+
+    automaton = ahocorasick.Automaton()
+    for token in distinct:
+        automaton.add_word(token, token)
+    automaton.make_automaton()
+
+    for position, value in enumerate(name_low_values):
+        found: set = set()
+        for end, token in automaton.iter(value):
+            if token in found:
+                continue
+            start = end - len(token) + 1
+            if token.isdigit():
+                boundary_ok = (
+                    (start == 0 or not value[start - 1].isdigit())
+                    and (end == len(value) - 1 or not value[end + 1].isdigit())
+                )
+            else:
+                boundary_ok = (
+                    (start == 0 or not _is_word_char(value[start - 1]))
+                    and (end == len(value) - 1 or not _is_word_char(value[end + 1]))
+                )
+            if boundary_ok:
+                found.add(token)
+
+        for token in found:
+            if token.isdigit():
+                num_hits[position] += 1
+            else:
+                word_hits[position] += word_counts[token]
+
+    return word_hits, num_hits
+
+
+def _token_hits_from_attrs(
+    df: pd.DataFrame,
+    words: List[str],
+    numbers: set,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Совпадения токенов через предвычисленные множества из attrs:
+    метки строк (исходные позиции) индексируют полные списки
+    name_word_tokens / name_number_tokens, совпадение — пересечение
+    set'ов. None — если attrs не подготовлены для этого df.
+
+    Токенизация при загрузке повторяет семантику regex-паттернов
+    только для \\w+-токенов: слова (границы \\b) и максимальные
+    цифровые последовательности (lookaround-правило). Токен с символом
+    вне \\w (например, оттенок "9.02") в множества не попадает —
+    для таких запросов возвращаем None и считаем через AC-фоллбэк.
+    """
+    if any(_NON_WORD_CHAR_RE.search(token) for token in words):
+        return None
+
+    word_tokens = df.attrs.get("name_word_tokens")
+    number_tokens = df.attrs.get("name_number_tokens")
+    if (
+        word_tokens is None
+        or number_tokens is None
+        or df.attrs.get("token_index_len") != len(word_tokens)
+    ):
+        return None
+
+    labels = df.index.to_numpy()
+    if labels.size == 0 or not np.issubdtype(labels.dtype, np.integer):
+        return None
+    if labels.min() < 0 or labels.max() >= len(word_tokens):
+        return None
+
+    # повторы слова в запросе бустятся столько же раз, сколько раньше
+    word_counts = Counter(words)
+    query_words = frozenset(word_counts)
+    query_numbers = frozenset(numbers)
+
+    word_hits = np.fromiter(
+        (
+            sum(word_counts[token] for token in word_tokens[label] & query_words)
+            for label in labels
+        ),
+        dtype=np.int64,
+        count=labels.size,
+    )
+    num_hits = np.fromiter(
+        (len(number_tokens[label] & query_numbers) for label in labels),
+        dtype=np.int64,
+        count=labels.size,
+    )
+    return word_hits, num_hits
+
+
 def apply_token_boosts(
     df: pd.DataFrame,
     raw_query: str,
@@ -513,53 +1157,47 @@ def apply_token_boosts(
     words = [t for t in tokens if not t.isdigit() and t not in STOP_WORDS]
     normalized_query = " ".join(tokens)
 
-    def calc_bonus(name: str) -> int:
-        if not isinstance(name, str):
-            name_str = str(name)
-        else:
-            name_str = name
-        name_low = name_str.lower()
-
-        word_hits = 0
-        for w in words:
-            if re.search(r"\b" + re.escape(w) + r"\b", name_low):
-                word_hits += 1
-
-        num_hits = 0
-        for n in numbers:
-            if re.search(r"(?<!\d)" + re.escape(n) + r"(?!\d)", name_low):
-                num_hits += 1
-
-        missing_words = max(0, len(words) - word_hits)
-        penalty = 0
-        if len(words) >= 2 and missing_words:
-            penalty = missing_words * WORD_MISSING_PENALTY
-
-        missing_numbers = max(0, len(numbers) - num_hits)
-        if missing_numbers:
-            penalty += missing_numbers * NUMBER_MISSING_PENALTY
-
-        full_words_bonus = 0
-        if words and missing_words == 0:
-            full_words_bonus = FULL_WORDS_MATCH_BONUS
-
-        phrase_bonus = 0
-        if normalized_query and normalized_query in name_low:
-            phrase_bonus = PHRASE_MATCH_BOOST
-
-        return (
-            word_hits * WORD_MATCH_BOOST
-            + num_hits * NUMBER_MATCH_BOOST
-            + full_words_bonus
-            + phrase_bonus
-            - penalty
-        )
-
     result = df.copy()
     if "Score" not in result.columns:
-        result["Score"] = 0
+        result["Score"] = np.zeros(len(result), dtype=np.int32)
+
+    name_low_values = result[name_column].str.lower().tolist()
+    n_rows = len(result)
 
-    result["Score"] = result["Score"].astype(int) + result[name_column].map(calc_bonus)
+    hits = _token_hits_from_attrs(result, words, numbers)
+    if hits is not None:
+        # токен-множества имён предвычислены при загрузке данных:
+        # совпадения — чистые пересечения set'ов, без сканирования строк
+        word_hits, num_hits = hits
+    else:
+        # все токены за один проход Aho-Corasick по каждому имени
+        # вместо K отдельных regex-проходов
+        word_hits, num_hits = _count_token_hits(name_low_values, words, numbers)
+
+    missing_words = len(words) - word_hits
+    penalty = np.zeros(n_rows, dtype=np.int64)
+    if len(words) >= 2:
+        penalty += missing_words * WORD_MISSING_PENALTY
+    penalty += (len(numbers) - num_hits) * NUMBER_MISSING_PENALTY
+
+    bonus = word_hits * WORD_MATCH_BOOST + num_hits * NUMBER_MATCH_BOOST - penalty
+    if words:
+        bonus += (missing_words == 0) * FULL_WORDS_MATCH_BONUS
+    if normalized_query:
+        # список тут на каждый вызов свой (срез результата), Arrow-кеш
+        # по id сюда не тянем — обычный проход по небольшому срезу
+        bonus += (
+            np.fromiter(
+                (normalized_query in value for value in name_low_values),
+                dtype=bool,
+                count=n_rows,
+            )
+            * PHRASE_MATCH_BOOST
+        )
+
+    result["Score"] = result["Score"].to_numpy(dtype=np.int32, copy=False) + bonus.astype(
+        np.int32, copy=False
+    )
 
     return result
 
@@ -577,28 +1215,190 @@ def filter_by_requirements(
     if not required_numbers and not required_type_groups:
         return df
 
-    name_series = df[name_column].astype(str)
-    mask = pd.Series(True, index=df.index)
+    # работаем по кешированным lower-значениям: паттерны уже в нижнем
+    # регистре, пандасовский case=False (lower на каждую строку) не нужен
+    name_values = _get_lowered_values(df, name_column)
+    mask = np.ones(len(df), dtype=bool)
 
     for number in required_numbers:
-        pattern = fr"(?<!\d){re.escape(number)}(?!\d)"
-        mask &= name_series.str.contains(pattern, case=False, na=False, regex=True)
+        pattern = re.compile(fr"(?<!\d){re.escape(number)}(?!\d)")
+        mask &= np.fromiter(
+            (pattern.search(value) is not None for value in name_values),
+            dtype=bool,
+            count=len(name_values),
+        )
 
     for group in required_type_groups:
-        pattern = r"\b(" + "|".join(re.escape(t) for t in group) + r")\b"
-        mask &= name_series.str.contains(pattern, case=False, na=False, regex=True)
+        pattern = re.compile(
+            r"\b(?:" + "|".join(re.escape(t) for t in group) + r")\b"
+        )
+        mask &= np.fromiter(
+            (pattern.search(value) is not None for value in name_values),
+            dtype=bool,
+            count=len(name_values),
+        )
 
-    filtered = df[mask].copy()
+    filtered = df.iloc[np.flatnonzero(mask)].copy()
     if filtered.empty:
         return df
     return filtered
 
 
+# ---------------------------------------------------------
+# Варианты запроса для fuzzy-поиска
+# ---------------------------------------------------------
+
+def _build_variants(
+    q_norm: str,
+    tokens: List[str],
+    tokens_lower: Optional[List[str]] = None,
+) -> List[str]:
+    """
+    Все варианты запроса для fuzzy: исходный запрос, первое слово,
+    склейка числа с единицей измерения, синонимы, раскладка и транслит.
+
+    Варианты нормализуются (strip + lower) при добавлении: fuzzy всё
+    равно приводит запрос к lower, поэтому различающиеся только
+    регистром/пробелами дубли — лишние проходы. Порядок вставки
+    сохраняем для детерминизма.
+
+    tokens_lower можно передать готовым, чтобы не пересчитывать.
+    """
+    variants: Dict[str, None] = {}
+
+    def add_variant(value: str) -> None:
+        value = value.strip().lower()
+        if value:
+            variants[value] = None
+
+    add_variant(q_norm)       # весь запрос
+    add_variant(tokens[0])    # только бренд/первое слово
+
+    units = {"мл", "ml", "л", "l", "г", "gr", "гр", "g", "кг", "kg"}
+    combined_tokens = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if (
+            token.isdigit()
+            and i + 1 < len(tokens)
+            and tokens[i + 1].lower() in units
+        ):
+            combined_tokens.append(f"{token}{tokens[i + 1]}")
+            i += 2
+            continue
+        combined_tokens.append(token)
+        i += 1
+    if combined_tokens != tokens:
+        add_variant(" ".join(combined_tokens))
+
+    # --- варианты с синонимами ---
+    synonyms = _load_synonyms()
+    if tokens_lower is None:
+        tokens_lower = [t.lower() for t in tokens]
+
+    for i, t_low in enumerate(tokens_lower):
+        if t_low in synonyms and synonyms[t_low]:
+            for alt in synonyms[t_low]:
+                # заменяем токен на синоним: Matrix 6RC -> socolor 6RC
+                new_tokens = list(tokens)
+                new_tokens[i] = alt
+                alt_query = " ".join(new_tokens)
+                add_variant(alt_query)
+
+                # ещё можно искать просто по самому синониму отдельно
+                add_variant(alt)
+
+    # раскладка / транслит для КАЖДОГО варианта
+    for v in list(variants):
+        converted = convert_layout(v)
+        if converted and converted != v:
+            add_variant(converted)
+
+        translit = transliterate(v)
+        if translit and translit != v:
+            add_variant(translit)
+
+    return list(variants)
+
+
+def _variant_scorer(variant: str):
+    """Scorer и порог для варианта — те же правила, что в search_with_fuzzy."""
+    token_count = len(variant.split())
+    if token_count <= 2:
+        return fuzz.token_set_ratio, 40
+    return fuzz.token_sort_ratio, 55
+
+
+def _slim_view(df: pd.DataFrame) -> pd.DataFrame:
+    """Узкая проекция (id, name) для текстового конвейера."""
+    pipeline_columns = [c for c in ("id", "name") if c in df.columns]
+    if 0 < len(pipeline_columns) < len(df.columns):
+        return df[pipeline_columns]
+    return df
+
+
+def _restore_full_rows(df: pd.DataFrame, result: pd.DataFrame) -> pd.DataFrame:
+    """Возвращаем полные строки df для результата, посчитанного на проекции."""
+    if result is None or result.empty:
+        return pd.DataFrame(columns=list(df.columns) + ["Score"])
+
+    full = df.loc[result.index].copy()
+    full["Score"] = result["Score"].to_numpy()
+    return full
+
+
 # ---------------------------------------------------------
 # Единая точка поиска по DataFrame
 # ---------------------------------------------------------
 
+# Кеш полного конвейера: (запрос, версии df/синонимов) -> (метки строк, баллы).
+# Запросы зипфовы — горячая голова отвечает из кеша без fuzzy-конвейера.
+_pipeline_cache: "OrderedDict[tuple, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+
+
 def search_dataframe(df: pd.DataFrame, raw_query: str) -> pd.DataFrame:
+    """Поиск с кешем результата по нормализованному запросу."""
+    if df is None or df.empty or not isinstance(raw_query, str):
+        return _search_dataframe_impl(df, raw_query)
+
+    # кешируем только канонический df из get_dataframe(): отфильтрованные
+    # кадры живут один запрос, id() освобождённого кадра переиспользуется,
+    # и кешированные метки чужого фильтра вернули бы не те строки
+    if get_position_indexes(df) is None:
+        return _search_dataframe_impl(df, raw_query)
+
+    # освежаем словарь синонимов до построения ключа, иначе первая же
+    # загрузка сдвинет версию и второй запрос промахнётся мимо кеша
+    _load_synonyms()
+    cache_key = (
+        raw_query.strip().lower(),
+        id(df),
+        len(df),
+        df.attrs.get("version"),
+        _synonyms_version,
+    )
+    cached = _pipeline_cache.get(cache_key)
+    if cached is not None:
+        _pipeline_cache.move_to_end(cache_key)
+        labels, scores = cached
+        result = df.loc[labels].copy()
+        result["Score"] = scores.copy()
+        return result
+
+    result = _search_dataframe_impl(df, raw_query)
+
+    # храним только метки строк и баллы: кортеж на порядки легче кадра
+    _pipeline_cache[cache_key] = (
+        result.index.to_numpy(),
+        result["Score"].to_numpy(dtype=np.int32, copy=True),
+    )
+    while len(_pipeline_cache) > SEARCH_CACHE_SIZE:
+        _pipeline_cache.popitem(last=False)
+    return result
+
+
+def _search_dataframe_impl(df: pd.DataFrame, raw_query: str) -> pd.DataFrame:
     """
     Общая логика:
     - нормализуем запрос (обрезка, чистка пунктуации)
@@ -614,6 +1414,24 @@ def search_dataframe(df: pd.DataFrame, raw_query: str) -> pd.DataFrame:
     if df is None or df.empty:
         return pd.DataFrame(columns=list(getattr(df, "columns", [])) + ["Score"])
 
+    # точное совпадение кода/штрихкода — отвечаем сразу, без конвейера
+    indexes = get_position_indexes(df)
+    if indexes is not None and isinstance(raw_query, str):
+        q_exact = raw_query.strip().lower()
+        if q_exact:
+            for exact_index in ("code_exact", "barcode_exact"):
+                positions = indexes.get(exact_index, {}).get(q_exact)
+                if positions is not None:
+                    result_df = df.iloc[positions].copy()
+                    # в выгрузке бывают полные дубли строк — как и в
+                    # основном конвейере, оставляем по одной на id
+                    if "id" in result_df.columns:
+                        result_df = result_df[~result_df["id"].duplicated()]
+                    result_df["Score"] = np.full(
+                        len(result_df), EXACT_MATCH_SCORE, dtype=np.int32
+                    )
+                    return result_df
+
     q_norm = normalize_query(raw_query)
     q_norm = replace_synonyms_in_query(q_norm)
     if not q_norm:
@@ -627,71 +1445,57 @@ def search_dataframe(df: pd.DataFrame, raw_query: str) -> pd.DataFrame:
 
     # ----- ТЕКСТОВАЯ ВЕТКА -----
     if not first_token.isdigit():
-        # базовый жёсткий поиск по первому слову
-        zero_df = simple_search(first_token, df)
-
-        # базовые варианты для fuzzy
-        variants = set()
-        variants.add(q_norm)       # весь запрос
-        variants.add(first_token)  # только бренд/первое слово
-
-        units = {"мл", "ml", "л", "l", "г", "gr", "гр", "g", "кг", "kg"}
-        combined_tokens = []
-        i = 0
-        while i < len(tokens):
-            token = tokens[i]
-            if (
-                token.isdigit()
-                and i + 1 < len(tokens)
-                and tokens[i + 1].lower() in units
-            ):
-                combined_tokens.append(f"{token}{tokens[i + 1]}")
-                i += 2
-                continue
-            combined_tokens.append(token)
-            i += 1
-        if combined_tokens != tokens:
-            variants.add(" ".join(combined_tokens))
+        # конвейер гоняем по узкой проекции (id, name): промежуточные
+        # копии не таскают остальные колонки, полные строки вернём в конце
+        slim = _slim_view(df)
 
-        # --- варианты с синонимами ---
-        synonyms = _load_synonyms()
+        # токены в lower считаем один раз на запрос
         tokens_lower = [t.lower() for t in tokens]
 
-        for i, t_low in enumerate(tokens_lower):
-            if t_low in synonyms and synonyms[t_low]:
-                for alt in synonyms[t_low]:
-                    # заменяем токен на синоним: Matrix 6RC -> socolor 6RC
-                    new_tokens = list(tokens)
-                    new_tokens[i] = alt
-                    alt_query = " ".join(new_tokens)
-                    variants.add(alt_query)
-
-                    # ещё можно искать просто по самому синониму отдельно
-                    variants.add(alt)
-
-        # раскладка / транслит для КАЖДОГО варианта
-        extra_variants = set()
-        for v in list(variants):
-            converted = convert_layout(v)
-            if converted and converted != v:
-                extra_variants.add(converted)
-
-            translit = transliterate(v)
-            if translit and translit != v:
-                extra_variants.add(translit)
-
-        variants |= extra_variants
-
-        # запускаем fuzzy для всех вариантов
-        fuzzy_frames = []
-        for v in variants:
-            fuzzy_df = search_with_fuzzy(v, df)
-            if not fuzzy_df.empty:
-                fuzzy_frames.append(fuzzy_df)
-
-        combined = merge_and_sort_dataframes(zero_df, *fuzzy_frames)
+        # частый случай: запрос целиком встречается в названиях —
+        # fuzzy-варианты ничего не добавят, сразу бусты и сортировка
+        phrase_positions = _simple_search_positions(q_norm, slim)
+        if phrase_positions.size >= PHRASE_SHORTCUT_MIN_HITS:
+            # названия, начинающиеся с запроса, словарный поиск мог не найти
+            prefix_positions = _prefix_search_positions(q_norm, slim)
+            if prefix_positions.size:
+                phrase_positions = np.union1d(phrase_positions, prefix_positions)
+            combined = slim.iloc[phrase_positions].copy()
+            combined["Score"] = np.full(phrase_positions.size, 100, dtype=np.int32)
+            boosted = apply_token_boosts(combined, q_norm)
+            return _restore_full_rows(df, sort_dataframes(boosted))
+
+        variants = _build_variants(q_norm, tokens, tokens_lower)
+
+        # один lower-список на все варианты запроса
+        col_values = _get_lowered_values(slim, "name")
+
+        # базовый жёсткий поиск по первому слову — сразу (позиции, баллы)
+        zero_positions = _simple_search_positions(first_token, slim)
+        hit_positions = [zero_positions]
+        hit_scores = [np.full(zero_positions.size, 100, dtype=np.int64)]
+
+        # префиксные совпадения полного запроса — дополнительный источник
+        # кандидатов (O(log N) по индексу, fuzzy их тоже найдёт, но дороже)
+        prefix_positions = _prefix_search_positions(q_norm, slim)
+        if prefix_positions.size:
+            hit_positions.append(prefix_positions)
+            hit_scores.append(np.full(prefix_positions.size, 100, dtype=np.int64))
+
+        # все варианты одним батчем cdist (параллелизм — внутри rapidfuzz);
+        # до сведения ничего не материализуем в DataFrame
+        fuzzy_positions, fuzzy_scores = _fuzzy_hits_batch(variants, col_values)
+        if fuzzy_positions.size:
+            hit_positions.append(fuzzy_positions)
+            hit_scores.append(fuzzy_scores)
+
+        positions, scores = _merge_hit_arrays(hit_positions, hit_scores)
+        if positions.size == 0:
+            combined = pd.DataFrame(columns=list(slim.columns) + ["Score"])
+        else:
+            combined = slim.iloc[positions].copy()
+            combined["Score"] = scores.astype(np.int32, copy=False)
 
-        tokens_lower = [t.lower() for t in tokens]
         required_numbers = {t for t in tokens_lower if t.isdigit()}
         required_type_groups = [
             group for group in PRODUCT_TYPE_GROUPS if group.intersection(tokens_lower)
@@ -704,7 +1508,7 @@ def search_dataframe(df: pd.DataFrame, raw_query: str) -> pd.DataFrame:
 
         # бустим по всем словам/числам исходного НОРМАЛИЗОВАННОГО запроса
         boosted = apply_token_boosts(combined, q_norm)
-        return sort_dataframes(boosted)
+        return _restore_full_rows(df, sort_dataframes(boosted))
 
     # ----- ЧИСЛОВАЯ ВЕТКА -----
     try:
@@ -713,28 +1517,200 @@ def search_dataframe(df: pd.DataFrame, raw_query: str) -> pd.DataFrame:
         return pd.DataFrame(columns=list(df.columns) + ["Score"])
 
     if len(numeric_token) > 2:
-        # Похоже на код/штрихкод
-        mask = (
-            df.get("code", pd.Series([], dtype=str))
-            .astype(str)
-            .str.contains(numeric_token, case=False, na=False)
-            | df.get("name", pd.Series([], dtype=str))
-            .astype(str)
-            .str.contains(numeric_token, case=False, na=False)
-            | df.get("barcode", pd.Series([], dtype=str))
-            .astype(str)
-            .str.contains(numeric_token, case=False, na=False)
-        )
-        result_df = df[mask].copy()
+        # Похоже на код/штрихкод: сначала пробуем индекс Aho-Corasick —
+        # полный код/штрихкод внутри запроса находится за один проход
+        # по самому запросу, без сканирования колонок.
+        automaton = _get_digit_automaton(df)
+        hit_positions: set = set()
+        if len(automaton) > 0:
+            for _, positions in automaton.iter(numeric_token):
+                hit_positions.update(positions)
+
+        if hit_positions:
+            result_df = df.iloc[sorted(hit_positions)].copy()
+        else:
+            # fallback: частичное вхождение числа в code/name/barcode —
+            # один проход по трём lower-спискам вместо трёх str.contains
+            columns = [
+                _get_lowered_values(df, column)
+                for column in ("code", "name", "barcode")
+                if column in df.columns
+            ]
+            if columns:
+                mask = np.zeros(len(df), dtype=bool)
+                for column_values in columns:
+                    mask |= _contains_mask(column_values, numeric_token)
+                result_df = df.iloc[np.flatnonzero(mask)].copy()
+            else:
+                result_df = df.iloc[[]].copy()
     else:
         # Короткое число — скорее номер оттенка в названии
         if "name" not in df.columns:
             return pd.DataFrame(columns=list(df.columns) + ["Score"])
-        mask = df["name"].astype(str).str.contains(numeric_token, case=False, na=False)
-        result_df = df[mask].copy()
+        name_values = _get_lowered_values(df, "name")
+        mask = _contains_mask(name_values, numeric_token)
+        result_df = df.iloc[np.flatnonzero(mask)].copy()
 
     if result_df.empty:
         return pd.DataFrame(columns=list(df.columns) + ["Score"])
 
-    result_df["Score"] = 120
+    result_df["Score"] = np.full(len(result_df), 120, dtype=np.int32)
     return sort_dataframes(result_df)
+
+
+def search_many(df: pd.DataFrame, queries: List[str]) -> List[pd.DataFrame]:
+    """
+    Батчевый поиск для /batch_query: fuzzy-варианты ВСЕХ запросов
+    считаются несколькими вызовами rapidfuzz.process.cdist (по одному
+    на пару scorer/порог, workers=-1), а не отдельным конвейером на
+    каждый запрос. Остальная логика (simple_search, фильтры, бусты)
+    совпадает с search_dataframe.
+    """
+    empty = pd.DataFrame(columns=list(getattr(df, "columns", [])) + ["Score"])
+    results: List[pd.DataFrame] = [empty] * len(queries)
+    if df is None or df.empty or not queries:
+        return results
+
+    col_values = _get_lowered_values(df, "name")
+
+    # текстовые запросы с их вариантами; числовые идут обычной веткой
+    text_items = []  # (позиция запроса, q_norm, tokens, variants)
+    for qi, raw in enumerate(queries):
+        if not isinstance(raw, str):
+            continue
+        q_norm = replace_synonyms_in_query(normalize_query(raw))
+        if not q_norm:
+            continue
+        tokens = q_norm.split()
+        if not tokens:
+            continue
+        if tokens[0].isdigit():
+            results[qi] = search_dataframe(df, raw)
+            continue
+        tokens_lower = [t.lower() for t in tokens]
+        text_items.append(
+            (qi, q_norm, tokens_lower, _build_variants(q_norm, tokens, tokens_lower))
+        )
+
+    if not text_items:
+        return results
+
+    # группируем варианты всех запросов по (scorer, порог)
+    groups: Dict[tuple, List[tuple]] = {}
+    for item_idx, (_, _, _, variants) in enumerate(text_items):
+        for v in variants:
+            scorer, threshold = _variant_scorer(v)
+            groups.setdefault((scorer, threshold), []).append((item_idx, v.lower()))
+
+    # лучший score по каждому товару для каждого запроса
+    best = np.zeros((len(text_items), len(col_values)), dtype=np.float32)
+    for (scorer, threshold), entries in groups.items():
+        matrix = process.cdist(
+            [v for _, v in entries],
+            col_values,
+            scorer=scorer,
+            score_cutoff=threshold,
+            workers=-1,
+        )
+        for row, (item_idx, _) in enumerate(entries):
+            np.maximum(best[item_idx], matrix[row], out=best[item_idx])
+
+    slim = _slim_view(df)
+
+    for item_idx, (qi, q_norm, tokens_lower, _) in enumerate(text_items):
+        scores = best[item_idx]
+        positions = np.flatnonzero(scores)
+
+        zero_df = simple_search(tokens_lower[0], slim)
+        frames = []
+        if positions.size:
+            fuzzy_df = slim.iloc[positions].copy()
+            fuzzy_df["Score"] = scores[positions].astype(np.int32, copy=False)
+            frames.append(fuzzy_df)
+
+        combined = merge_hits(slim, zero_df, *frames)
+
+        required_numbers = {t for t in tokens_lower if t.isdigit()}
+        required_type_groups = [
+            group for group in PRODUCT_TYPE_GROUPS if group.intersection(tokens_lower)
+        ]
+        combined = filter_by_requirements(
+            combined,
+            required_numbers=required_numbers,
+            required_type_groups=required_type_groups,
+        )
+
+        boosted = apply_token_boosts(combined, q_norm)
+        results[qi] = _restore_full_rows(df, sort_dataframes(boosted))
+
+    return results
+
+
+# ---------------------------------------------------------
+# Кеш результатов поиска для повторяющихся запросов
+# ---------------------------------------------------------
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "4096"))
+
+# (запрос, producer_ids, версия df) -> кортеж id в порядке релевантности
+_search_ids_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def clear_search_cache() -> None:
+    """Сбрасываем кеши результатов (например, при обновлении данных)."""
+    _search_ids_cache.clear()
+    _pipeline_cache.clear()
+
+
+def search_ids(
+    df: pd.DataFrame,
+    raw_query: str,
+    producer_ids: Optional[Tuple[int, ...]] = None,
+) -> tuple:
+    """
+    Поиск, возвращающий кортеж уникальных id в порядке релевантности.
+
+    Результат кешируется по (запрос, producer_ids, версия DataFrame),
+    поэтому повторяющиеся запросы не запускают fuzzy-конвейер заново.
+    """
+    query_key = raw_query.strip() if isinstance(raw_query, str) else ""
+    # версии данных и словаря синонимов — в ключе, как у _pipeline_cache:
+    # иначе после обновления synonyms.json отдаются устаревшие id
+    _load_synonyms()
+    cache_key = (
+        query_key,
+        producer_ids,
+        id(df),
+        len(df),
+        df.attrs.get("version"),
+        _synonyms_version,
+    )
+
+    cached = _search_ids_cache.get(cache_key)
+    if cached is not None:
+        _search_ids_cache.move_to_end(cache_key)
+        return cached
+
+    df_filtered = filter_by_producer_ids(df, producer_ids)
+
+    result_df = search_dataframe(df_filtered, raw_query)
+
+    ids: List = []
+    if not result_df.empty:
+        if "id" not in result_df.columns:
+            raise KeyError("Dataframe does not contain 'id' column.")
+        # дедупликация одним numpy-проходом с сохранением порядка
+        ids_arr = (
+            pd.to_numeric(result_df["id"], errors="coerce")
+            .dropna()
+            .astype(np.int64)
+            .to_numpy()
+        )
+        _, first = np.unique(ids_arr, return_index=True)
+        ids = ids_arr[np.sort(first)].tolist()
+
+    result = tuple(ids)
+    _search_ids_cache[cache_key] = result
+    while len(_search_ids_cache) > SEARCH_CACHE_SIZE:
+        _search_ids_cache.popitem(last=False)
+    return result
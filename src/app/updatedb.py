@@ -3,32 +3,89 @@ import psycopg2
 import os
 
 
+# креды берём из окружения; пароль — только из окружения, без дефолта
+if 'SEARCH_DB_PASSWORD' not in os.environ:
+    raise RuntimeError('SEARCH_DB_PASSWORD is not set')
+
 database_config = {
-    'host': '172.16.0.86',
-    'database': 'api_b2b',
-    'user': 'api',
-    'password': 'qazwsx12!@D',
-    'port': '5432',
+    'host': os.environ.get('SEARCH_DB_HOST', '172.16.0.86'),
+    'database': os.environ.get('SEARCH_DB_NAME', 'api_b2b'),
+    'user': os.environ.get('SEARCH_DB_USER', 'api'),
+    'password': os.environ['SEARCH_DB_PASSWORD'],
+    'port': os.environ.get('SEARCH_DB_PORT', '5432'),
 }
 
 # Connection to the PostgreSQL database
 connection = psycopg2.connect(**database_config)
 
-# Fetch data from the PostgreSQL table into a DataFrame
-query = """SELECT b."id", name, code, "propsNoFilter" ->> 'barcode' as barcode, "props" ->> 'producer' as producerId 
+# Триграммный индекс для fuzzy-поиска на стороне БД (pg_trgm):
+# SQL-клиенты могут искать через "name % :q / similarity(...)",
+# сам сервис продолжает искать in-process по CSV-выгрузке.
+trgm_statements = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS idx_abes_name_trgm
+        ON a_block_element_search USING gin (name gin_trgm_ops)""",
+]
+
+# Полнотекстовый поиск: заполняем tsvector_name триггером и индексируем.
+# Колонка уже есть в схеме a_block_element_search, но ничем не заполнялась.
+fts_statements = [
+    """CREATE OR REPLACE FUNCTION abes_tsvector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.tsvector_name :=
+            setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('russian', coalesce(NEW.code, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    """DROP TRIGGER IF EXISTS tg_abes_tsvector ON a_block_element_search""",
+    """CREATE TRIGGER tg_abes_tsvector
+        BEFORE INSERT OR UPDATE OF name, code ON a_block_element_search
+        FOR EACH ROW EXECUTE FUNCTION abes_tsvector_update()""",
+    # разовый бэкфилл: триггер заполняет tsvector только при изменениях,
+    # существующие строки прогоняем через него no-op апдейтом
+    """UPDATE a_block_element_search SET name = name
+        WHERE tsvector_name IS NULL""",
+    """CREATE INDEX IF NOT EXISTS idx_abes_tsv
+        ON a_block_element_search USING gin (tsvector_name)""",
+]
+
+for statement in trgm_statements + fts_statements:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(statement)
+        connection.commit()
+    except psycopg2.Error as error:
+        # нет прав/расширения — выгрузка данных всё равно должна пройти
+        connection.rollback()
+        print(f"skipped: {' '.join(statement.split()[:6])} ({error.pgerror or error})")
+
+# Fetch data from the PostgreSQL table
+query = """SELECT b."id", name, code, "propsNoFilter" ->> 'barcode' as barcode, "props" ->> 'producer' as producerId
     FROM a_block_element AS b
-    INNER JOIN a_warehouse_remains AS w ON b."id" = w."productId" 
-    WHERE name NOT LIKE '%Образец%' 
-        AND name NOT LIKE '%РЕКЛАМА%' 
-        AND name NOT LIKE '%ОБРАЗЕЦ%' 
+    INNER JOIN a_warehouse_remains AS w ON b."id" = w."productId"
+    WHERE name NOT LIKE '%Образец%'
+        AND name NOT LIKE '%РЕКЛАМА%'
+        AND name NOT LIKE '%ОБРАЗЕЦ%'
         AND CAST((props#>>'{beautyHouseCategory}') AS DOUBLE PRECISION) > 0
         AND props#>>'{isSellout}' IS NULL
         AND active = true
 and "blockId" = 1"""
 
-df = pd.read_sql_query(query, connection)
+# Стримим результат прямо в CSV через COPY: без материализации
+# всех строк в Python и без повторной сериализации pandas'ом
+with open('./my_data_file.csv', 'wb') as csv_file, connection.cursor() as cursor:
+    cursor.copy_expert(
+        f"COPY ({query}) TO STDOUT WITH (FORMAT CSV, HEADER)", csv_file
+    )
 
-# Save df to the file
-df.to_csv('./my_data_file.csv', index=False)
+# Parquet-копия для сервиса: загрузка без повторного парсинга CSV,
+# строковые колонки — сразу Arrow-буферы (офсеты+байты, без PyObject на строку).
+# dtype обязателен: NULL-штрихкод без него превратил бы колонку во float,
+# и parquet хранил бы "…0754.0" (см. комментарий к _STRING_COLUMNS в database.py)
+df = pd.read_csv(
+    './my_data_file.csv', dtype={'code': str, 'name': str, 'barcode': str}
+)
+df.to_parquet('./data.parquet', engine='pyarrow', compression='zstd')
 
 print("updated")